@@ -1,56 +1,229 @@
 # student_server.py
 import os
 import re
-import json
 import base64
+import hmac
 import uuid
+import fcntl
+import contextlib
+import logging
+import functools
 import time
-import shutil
-import tempfile
-import subprocess
+import threading
+import multiprocessing
 from pathlib import Path
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import msgspec
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from flask import Flask, request, jsonify
 
 app = Flask(__name__)
 
+# LOG_LEVEL is case-insensitive; an unknown name falls back to INFO instead of failing startup
+_log_level = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO").upper())
+logging.basicConfig(level=_log_level if isinstance(_log_level, int) else logging.INFO)
+logger = logging.getLogger(__name__)
+
 # === Config ===
-SECRETS_FILE = "student_secrets.json"   # keep private; add to .gitignore
-WORKDIR_BASE = Path("workspaces")
-WORKDIR_BASE.mkdir(exist_ok=True)
+SECRETS_FILE = "student_secrets.ndjson"   # append-only log; keep private; add to .gitignore
+LEGACY_SECRETS_FILE = "student_secrets.json"   # pre-log format, migrated on first start
+SECRETS_LOCK_FILE = SECRETS_FILE + ".lock"   # flock'd by every server process writing the log
 MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "4"))
 PORT = int(os.environ.get("PORT", "8000"))
 GH_TOKEN = os.environ.get("GH_TOKEN")
 GH_USER = os.environ.get("GH_USER")
+if not GH_TOKEN:
+    raise RuntimeError("GH_TOKEN not set in environment")
+_GH_HEADERS = {"Authorization": f"token {GH_TOKEN}", "Accept": "application/vnd.github+json"}
 HOST = os.environ.get("HOST", f"http://localhost:{PORT}")
 
-executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+# One pooled session for GitHub API and evaluation_url calls so repeat requests
+# reuse keep-alive connections instead of a fresh TCP+TLS handshake each time.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0))
+
+# Tasks run in worker processes (not threads) so concurrent tasks don't contend
+# on the GIL. The pool is created lazily on first submit, and with forkserver
+# workers start from a clean interpreter instead of a copy of the Flask process.
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+    return _executor
+
+def _log_task_failure(name, future):
+    # process_task logs its own errors; this catches tasks lost with a broken pool
+    if future.cancelled():
+        logger.error("Task %s was cancelled before it ran", name)
+    elif future.exception() is not None:
+        logger.error("Task %s failed: %r", name, future.exception())
+
+def submit_task(fn, *args):
+    """Submit to the task pool, replacing it if a dead worker (OOM kill, signal) broke it."""
+    global _executor
+    pool = get_executor()
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        with _executor_lock:
+            if _executor is pool:  # concurrent requests replace a broken pool only once
+                logger.warning("Task pool is broken; starting a new one")
+                pool.shutdown(wait=False, cancel_futures=True)
+                _executor = None
+        future = get_executor().submit(fn, *args)
+    future.add_done_callback(functools.partial(_log_task_failure, fn.__name__))
+    return future
 
 # === Basic helpers ===
-def load_secrets():
-    if Path(SECRETS_FILE).exists():
-        return json.loads(Path(SECRETS_FILE).read_text())
-    return {}
+# Several server processes may share one log (gunicorn -w N), and each keeps its
+# own secrets_map; _secrets_log_pos is (inode, byte offset) of what it has read.
+# secrets_map is copy-on-write: writers build a new dict under _SECRETS_LOCK and
+# rebind it, so api_task reads a complete snapshot without taking the lock.
+# _SECRETS_LOCK only covers this process; appends and compaction also hold
+# secrets_file_lock() so a compaction never os.replace()s away another
+# process's append.
+_SECRETS_LOCK = threading.Lock()
+_secrets_log_pos = (None, 0)
+
+@contextlib.contextmanager
+def secrets_file_lock():
+    with open(SECRETS_LOCK_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _read_secrets_log(m, start=0):
+    """Apply complete log lines from byte offset start to m; returns (lines read, end offset)."""
+    with open(SECRETS_FILE, "rb") as f:
+        f.seek(start)
+        data = f.read()
+    end = data.rfind(b"\n") + 1  # a partial trailing line is left for the next read
+    lines = 0
+    for line in data[:end].splitlines():
+        lines += 1
+        try:
+            entry = orjson.loads(line)
+        except ValueError:
+            continue  # blank or torn line from an interrupted append
+        if not isinstance(entry, dict):
+            continue
+        email, secret = entry.get("email"), entry.get("secret")
+        if isinstance(email, str) and isinstance(secret, str):
+            m[email] = secret
+    return lines, start + end
 
-secrets_map = load_secrets()
+def load_secrets():
+    """Replay the secrets log (later lines win); compact it if it has superseded or torn lines."""
+    global _secrets_log_pos
+    path = Path(SECRETS_FILE)
+    with secrets_file_lock():
+        if not path.exists():
+            legacy = Path(LEGACY_SECRETS_FILE)
+            old = orjson.loads(legacy.read_bytes()) if legacy.exists() else {}
+            if not isinstance(old, dict):
+                logger.warning("Ignoring %s: expected a JSON object", LEGACY_SECRETS_FILE)
+                old = {}
+            m = {email: secret for email, secret in old.items() if isinstance(secret, str)}
+            if m:
+                save_secrets_map(m)
+        else:
+            m = {}
+            lines, end = _read_secrets_log(m)
+            if lines > len(m) or end < path.stat().st_size:
+                save_secrets_map(m)
+        if path.exists():
+            st = path.stat()
+            _secrets_log_pos = (st.st_ino, st.st_size)
+    return m
+
+def refresh_secrets():
+    """Apply secrets added or rotated by other server processes since this one last read the log."""
+    global secrets_map, _secrets_log_pos
+    try:
+        st = os.stat(SECRETS_FILE)
+    except FileNotFoundError:
+        return
+    if (st.st_ino, st.st_size) == _secrets_log_pos:  # unchanged: one stat, no lock
+        return
+    with _SECRETS_LOCK:
+        try:
+            st = os.stat(SECRETS_FILE)
+        except FileNotFoundError:
+            return
+        ino, pos = _secrets_log_pos
+        if st.st_ino != ino or st.st_size < pos:  # log was rewritten; replay it all
+            pos = 0
+        if st.st_size > pos:
+            new = dict(secrets_map)
+            _, pos = _read_secrets_log(new, pos)
+            secrets_map = new
+        _secrets_log_pos = (st.st_ino, pos)
 
 def save_secrets_map(m):
-    Path(SECRETS_FILE).write_text(json.dumps(m, indent=2))
-
-def decode_data_uri_to_file(data_uri: str, out_path: Path):
-    m = re.match(r"data:(.*?);base64,(.*)", data_uri, re.S)
+    """Rewrite the log with a single line per email, atomically via a temp file and os.replace.
+    Callers must hold secrets_file_lock()."""
+    tmp = f"{SECRETS_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"".join(orjson.dumps({"email": email, "secret": secret}) + b"\n" for email, secret in m.items()))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, SECRETS_FILE)
+
+def append_secret(email, secret):
+    """Persist one secret in O(1): append a line instead of rewriting the file."""
+    with secrets_file_lock(), open(SECRETS_FILE, "ab") as f:
+        f.write(orjson.dumps({"email": email, "secret": secret}) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+# Pool workers re-import this module but never serve requests, so the log is
+# read (and compacted) on a server's first request rather than at import.
+secrets_map = {}
+_server_state_ready = False
+
+def ensure_server_state():
+    global secrets_map, _server_state_ready
+    if _server_state_ready:
+        return
+    with _SECRETS_LOCK:
+        if not _server_state_ready:
+            secrets_map = load_secrets()
+            _server_state_ready = True
+
+# Matches only the header; the payload is sliced off after it so the regex
+# engine never walks a multi-MB base64 string. [^,] keeps the scan in the header.
+_DATA_URI_HEAD = re.compile(r"data:[^,]*?;base64,", re.A)
+# characters outside the base64 alphabet (line breaks in wrapped base64) are
+# dropped, as base64.b64decode does without validate=True
+_B64_JUNK = re.compile(r"[^A-Za-z0-9+/=]")
+
+def data_uri_base64(data_uri: str) -> str:
+    """Return the base64 payload of a data URI, checked but not decoded, for uploading as-is."""
+    m = _DATA_URI_HEAD.match(data_uri)
     if not m:
         raise ValueError("Invalid data URI")
-    b64 = m.group(2)
-    out_path.write_bytes(base64.b64decode(b64))
-
-def run(cmd, cwd=None):
-    """Run command and return CompletedProcess (raises on non-zero)."""
-    print(f"> {' '.join(cmd)} (cwd={cwd})")
-    return subprocess.run(cmd, cwd=cwd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    b64 = data_uri[m.end():]
+    if _B64_JUNK.search(b64):
+        b64 = _B64_JUNK.sub("", b64)
+    # whole 4-character groups, with '=' only as one or two trailing pad characters
+    body = b64.rstrip("=")
+    if len(b64) % 4 or len(b64) - len(body) > 2 or "=" in body:
+        raise ValueError("Invalid base64 payload in data URI")
+    return b64
 
 # Minimal MIT license text (replace with full text if desired)
 MIT_TEXT = """MIT License
@@ -60,14 +233,21 @@ Copyright (c) {year} {owner}
 Permission is hereby granted, free of charge, to any person obtaining a copy
 of this software...
 """
-def write_mit_license(path: Path, owner: str):
-    path.write_text(MIT_TEXT.format(year=datetime.utcnow().year, owner=owner))
+# [year, monotonic time it was read]; re-read at most once a day
+_YEAR_CACHE = [datetime.utcnow().year, time.monotonic()]
+
+def _year():
+    if time.monotonic() - _YEAR_CACHE[1] > 86400:
+        _YEAR_CACHE[:] = [datetime.utcnow().year, time.monotonic()]
+    return _YEAR_CACHE[0]
+
+@functools.lru_cache(maxsize=8)
+def _mit_bytes(year: int, owner: str) -> bytes:
+    return MIT_TEXT.format(year=year, owner=owner).encode("utf-8")
 
 # === Minimal deterministic generator (LLM hook spot) ===
-def generate_minimal_app(brief: str, attachments: list):
-    # attachments: list of dicts {name: ..., url: ...}
-    default_asset = attachments[0]["name"] if attachments else ""
-    index_html = f"""<!doctype html>
+# Templates are filled with str.format_map, so literal braces are doubled.
+INDEX_TMPL = """<!doctype html>
 <html>
   <head><meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1"><title>Task App</title></head>
   <body>
@@ -99,64 +279,124 @@ def generate_minimal_app(brief: str, attachments: list):
     </script>
   </body>
 </html>"""
-    readme = f"# Auto-generated Task App\n\n**Brief:** {brief}\n\nUsage: open `index.html` or deploy to Pages and use `?url=` parameter.\n"
-    return {"index.html": index_html, "README.md": readme}
+README_TMPL = "# Auto-generated Task App\n\n**Brief:** {brief}\n\nUsage: open `index.html` or deploy to Pages and use `?url=` parameter.\n"
+
+def generate_minimal_app(brief: str, attachments: list):
+    # attachments: list of dicts {name: ..., url: ...}
+    default_asset = attachments[0]["name"] if attachments else ""
+    return {
+        "index.html": INDEX_TMPL.format_map({"default_asset": default_asset}),
+        "README.md": README_TMPL.format_map({"brief": brief}),
+    }
 
 # === GitHub API helpers ===
 def github_create_repo(repo_name, description="Auto-generated repo", private=False):
-    if not GH_TOKEN:
-        raise RuntimeError("GH_TOKEN not set in environment")
     url = "https://api.github.com/user/repos"
-    headers = {"Authorization": f"token {GH_TOKEN}", "Accept": "application/vnd.github+json"}
     body = {"name": repo_name, "description": description, "private": private}
-    r = requests.post(url, json=body, headers=headers, timeout=15)
+    r = SESSION.post(url, json=body, headers=_GH_HEADERS, timeout=15)
     r.raise_for_status()
     return r.json()
 
-def github_enable_pages(owner, repo):
-    if not GH_TOKEN:
-        raise RuntimeError("GH_TOKEN not set")
+def github_seed_branch(owner, repo, branch="main"):
+    """Give a new empty repo a first commit on `branch` holding only an empty .nojekyll.
+    The Git Data API rejects empty repos, and unlike an auto_init README this commit
+    has nothing Pages can serve, so Pages can be enabled before the real files land."""
+    url = f"https://api.github.com/repos/{owner}/{repo}/contents/.nojekyll"
+    r = SESSION.put(url, json={"message": "Initialize repository", "content": "", "branch": branch}, headers=_GH_HEADERS, timeout=15)
+    r.raise_for_status()
+
+def github_commit_files(owner, repo, files: dict, message, author_name, author_email, branch="main"):
+    """Commit files ({repo path: base64 content}) as the tip of `branch` via the Git Data API;
+    returns the sha. The repo must not be empty (see github_seed_branch); its commit is replaced."""
+    api = f"https://api.github.com/repos/{owner}/{repo}/git"
+    # blob bodies carry whole attachments, so serialize them with orjson in one pass
+    blob_headers = {**_GH_HEADERS, "Content-Type": "application/json"}
+
+    def create_blob(content):
+        body = orjson.dumps({"content": content, "encoding": "base64"})
+        r = SESSION.post(f"{api}/blobs", data=body, headers=blob_headers, timeout=30)
+        r.raise_for_status()
+        return r.json()["sha"]
+
+    # blobs are independent, so upload them in parallel over the pooled session
+    paths = sorted(files)
+    with ThreadPoolExecutor(max_workers=min(8, len(paths) or 1)) as pool:
+        blob_shas = list(pool.map(create_blob, (files[p] for p in paths)))
+
+    tree = [{"path": path, "mode": "100644", "type": "blob", "sha": sha}
+            for path, sha in zip(paths, blob_shas)]
+    r = SESSION.post(f"{api}/trees", json={"tree": tree}, headers=_GH_HEADERS, timeout=15)
+    r.raise_for_status()
+    body = {
+        "message": message,
+        "tree": r.json()["sha"],
+        "parents": [],
+        "author": {"name": author_name, "email": author_email},
+    }
+    r = SESSION.post(f"{api}/commits", json=body, headers=_GH_HEADERS, timeout=15)
+    r.raise_for_status()
+    commit_sha = r.json()["sha"]
+    r = SESSION.patch(f"{api}/refs/heads/{branch}", json={"sha": commit_sha, "force": True},
+                      headers=_GH_HEADERS, timeout=15)
+    r.raise_for_status()
+    return commit_sha
+
+def github_enable_pages(owner, repo, branch="main"):
     url = f"https://api.github.com/repos/{owner}/{repo}/pages"
-    headers = {"Authorization": f"token {GH_TOKEN}", "Accept": "application/vnd.github+json"}
-    body = {"source": {"branch": "main", "path": "/"}}
+    body = {"source": {"branch": branch, "path": "/"}}
     # Some accounts need PUT/POST variations; we'll try POST then fallback to PUT
-    r = requests.post(url, json=body, headers=headers, timeout=10)
+    r = SESSION.post(url, json=body, headers=_GH_HEADERS, timeout=10)
     if r.status_code not in (201, 202):  # 201 Created or 202 Accepted
         # Try PUT (older API)
-        r = requests.put(url, json=body, headers=headers, timeout=10)
+        r = SESSION.put(url, json=body, headers=_GH_HEADERS, timeout=10)
     return r
 
-def wait_for_pages(pages_url, timeout=180, poll_interval=2):
-    end = time.time() + timeout
-    while time.time() < end:
+def wait_for_pages(pages_url, timeout=180, initial_delay=1, max_delay=10):
+    """HEAD-probe pages_url over the pooled session until it serves a 200, backing off 1.5x."""
+    end = time.monotonic() + timeout
+    delay = initial_delay
+    while time.monotonic() < end:
         try:
-            r = requests.get(pages_url, timeout=10)
+            r = SESSION.head(pages_url, allow_redirects=True, timeout=10)
             if r.status_code == 200:
                 return True
         except Exception:
             pass
-        time.sleep(poll_interval)
+        time.sleep(min(delay, max(end - time.monotonic(), 0)))
+        delay = min(delay * 1.5, max_delay)
     return False
 
-def notify_with_backoff(eval_url, payload, max_attempts=8):
+def _retry_after_seconds(r):
+    try:
+        return int(r.headers.get("Retry-After", "0"))
+    except ValueError:  # HTTP-date form; fall back to our own backoff
+        return 0
+
+def notify_with_backoff(eval_url, payload, max_attempts=8, max_delay=60):
     delay = 1
     headers = {"Content-Type": "application/json"}
     for attempt in range(max_attempts):
+        sleep_for = delay
         try:
-            r = requests.post(eval_url, json=payload, headers=headers, timeout=10)
-            print("Notify attempt", attempt+1, "status", r.status_code)
-            if r.status_code == 200:
+            r = SESSION.post(eval_url, json=payload, headers=headers, timeout=10)
+            logger.info("Notify attempt %d status %s", attempt + 1, r.status_code)
+            if 200 <= r.status_code < 300:
                 return True
+            # other 4xx won't succeed on retry; 408/429 are the retryable ones
+            if 400 <= r.status_code < 500 and r.status_code not in (408, 429):
+                return False
+            sleep_for = min(max(delay, _retry_after_seconds(r)), max_delay)
         except Exception as e:
-            print("Notify error:", e)
-        time.sleep(delay)
-        delay = min(delay*2, 60)
+            logger.warning("Notify error: %s", e)
+        if attempt + 1 < max_attempts:
+            time.sleep(sleep_for)
+        delay = min(delay*2, max_delay)
     return False
 
 # === Core processing ===
 def process_task(task_json):
     try:
-        print("Processing task:", task_json.get("task"))
+        logger.info("Processing task: %s", task_json.get("task"))
         email = task_json["email"]
         task_id = task_json["task"]
         round_no = int(task_json.get("round", 1))
@@ -165,56 +405,37 @@ def process_task(task_json):
         attachments = task_json.get("attachments", [])
         evaluation_url = task_json.get("evaluation_url")
 
-        ws = Path(tempfile.mkdtemp(prefix=f"task-{task_id}-"))
-        print("Workspace:", ws)
-
-        # Write attachments
-        for att in attachments:
-            name = att["name"]
-            url = att["url"]
-            out = ws / name
-            decode_data_uri_to_file(url, out)
-            print("Attachment written:", out)
-
-        # Generate files
-        files = generate_minimal_app(brief, attachments)
-        for fname, content in files.items():
-            (ws / fname).write_text(content, encoding="utf-8")
-
-        # LICENSE
-        write_mit_license(ws / "LICENSE", owner=GH_USER or "unknown")
-
-        # init git
-        run(["git", "init"], cwd=str(ws))
-        run(["git", "config", "user.email", email], cwd=str(ws))
-        run(["git", "config", "user.name", GH_USER or "student"], cwd=str(ws))
-        run(["git", "add", "--all"], cwd=str(ws))
-        run(["git", "commit", "-m", f"Initial commit for {task_id} round {round_no}"], cwd=str(ws))
-
-        # create repo
+        # Attachments are already base64: check them and upload the payload as-is
+        # rather than decoding and re-encoding; generated files never touch disk
+        files = {att["name"]: data_uri_base64(att["url"]) for att in attachments}
+        for fname, content in generate_minimal_app(brief, attachments).items():
+            files[fname] = base64.b64encode(content.encode("utf-8")).decode("ascii")
+        files["LICENSE"] = base64.b64encode(_mit_bytes(_year(), GH_USER or "unknown")).decode("ascii")
+
+        # create repo with a placeholder commit on the account's default branch
         repo_name = f"{task_id}-{uuid.uuid4().hex[:6]}"
         gh_info = github_create_repo(repo_name, description=f"Task {task_id} round {round_no}", private=False)
         repo_url = gh_info["html_url"]
-
-        # push (use token in remote URL only in transient process; do not log)
-        remote_url = f"https://{GH_TOKEN}@github.com/{GH_USER}/{repo_name}.git"
-        run(["git", "remote", "add", "origin", remote_url], cwd=str(ws))
-        run(["git", "branch", "-M", "main"], cwd=str(ws))
-        run(["git", "push", "-u", "origin", "main"], cwd=str(ws))
-
-        # get commit sha
-        cp = run(["git", "rev-parse", "HEAD"], cwd=str(ws))
-        commit_sha = cp.stdout.strip()
-
-        # enable pages
-        pages_resp = github_enable_pages(GH_USER, repo_name)
-        print("Pages API status:", pages_resp.status_code if pages_resp is not None else None)
+        branch = gh_info["default_branch"]
+        github_seed_branch(GH_USER, repo_name, branch)
+
+        # enable pages while the files are committed straight through the API
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pages_future = pool.submit(github_enable_pages, GH_USER, repo_name, branch)
+            commit_sha = github_commit_files(
+                GH_USER, repo_name, files, f"Initial commit for {task_id} round {round_no}",
+                GH_USER or "student", email, branch=branch,
+            )
+            pages_resp = pages_future.result()
+        del files  # the base64 copies aren't needed for the Pages wait and notify
+
+        logger.info("Pages API status: %s", pages_resp.status_code if pages_resp is not None else None)
         pages_url = f"https://{GH_USER}.github.io/{repo_name}/"
 
         # wait for pages to become available
         ok = wait_for_pages(pages_url, timeout=180)
         if not ok:
-            print("Warning: pages did not become available in time:", pages_url)
+            logger.warning("Pages did not become available in time: %s", pages_url)
 
         payload = {
             "email": email,
@@ -229,46 +450,76 @@ def process_task(task_json):
         if evaluation_url:
             success = notify_with_backoff(evaluation_url, payload)
             if not success:
-                print("Failed to notify evaluation_url after retries.")
+                logger.error("Failed to notify evaluation_url after retries.")
 
-        print("Finished task:", task_id, "repo:", repo_url)
-        # Optional cleanup: shutil.rmtree(ws)
+        logger.info("Finished task: %s repo: %s", task_id, repo_url)
 
     except Exception as e:
-        print("Error in process_task:", e)
+        logger.exception("Error in process_task: %s", e)
 
 # === Flask endpoints ===
+class Attachment(msgspec.Struct):
+    name: str
+    url: str
+
+class TaskIn(msgspec.Struct):
+    """/api/task body; decoded and validated in one pass by msgspec."""
+    email: str
+    secret: str
+    task: str
+    round: int
+    nonce: str
+    brief: str
+    evaluation_url: str
+    attachments: list[Attachment] = []
+
+_TASK_DECODER = msgspec.json.Decoder(TaskIn)
+
 @app.route("/api/task", methods=["POST"])
 def api_task():
+    ensure_server_state()
     try:
-        data = request.get_json(force=True)
-    except Exception:
+        t = _TASK_DECODER.decode(request.get_data(cache=False))
+    except msgspec.ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except msgspec.DecodeError:
         return jsonify({"error": "invalid json"}), 400
 
-    required = ["email", "secret", "task", "round", "nonce", "brief", "evaluation_url"]
-    for k in required:
-        if k not in data:
-            return jsonify({"error": f"missing {k}"}), 400
-
-    email = data["email"]
-    secret = data["secret"]
+    email = t.email
+    secret = t.secret
+    # another server process may have added or rotated this secret
+    refresh_secrets()
     stored = secrets_map.get(email)
-    if stored is None or stored != secret:
+    if stored is None or not hmac.compare_digest(stored.encode("utf-8"), secret.encode("utf-8")):
         return jsonify({"error": "invalid secret"}), 400
 
+    # secret is checked here; workers don't share secrets_map and never see it
+    task = msgspec.to_builtins(t)  # plain dicts, attachments included
+    del task["secret"]
+
     # immediate ack
-    executor.submit(process_task, data)
+    submit_task(process_task, task)
     return jsonify({"status": "accepted"}), 200
 
 @app.route("/admin/add_secret", methods=["POST"])
 def admin_add_secret():
-    body = request.get_json(force=True)
+    global secrets_map
+    ensure_server_state()
+    try:
+        body = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return jsonify({"error": "invalid json"}), 400
+    if not isinstance(body, dict):
+        return jsonify({"error": "need email & secret"}), 400
     email = body.get("email")
     secret = body.get("secret")
-    if not email or not secret:
+    if not (isinstance(email, str) and email and isinstance(secret, str) and secret):
         return jsonify({"error": "need email & secret"}), 400
-    secrets_map[email] = secret
-    save_secrets_map(secrets_map)
+    with _SECRETS_LOCK:
+        new = dict(secrets_map)
+        new[email] = secret
+        append_secret(email, secret)
+        secrets_map = new
     return jsonify({"status": "saved"}), 200
 
 if __name__ == "__main__":
@@ -0,0 +1,407 @@
+import base64
+import functools
+import importlib.util
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import orjson
+import pytest
+import requests
+
+os.environ.setdefault("GH_TOKEN", "test-token")
+
+import student_server  # noqa: E402
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 300000])
+def test_data_uri_base64(size):
+    data = os.urandom(size)
+    b64 = student_server.data_uri_base64("data:image/png;base64," + base64.b64encode(data).decode())
+    assert base64.b64decode(b64, validate=True) == data
+
+
+@pytest.mark.parametrize("size", [1, 49153, 300000])
+def test_data_uri_base64_wrapped(size):
+    # base64.encodebytes wraps at 76 columns, like MIME
+    data = os.urandom(size)
+    b64 = student_server.data_uri_base64("data:image/png;base64," + base64.encodebytes(data).decode())
+    assert base64.b64decode(b64, validate=True) == data
+
+
+@pytest.mark.parametrize("uri", [
+    "data:text/plain,hello",
+    "data:image/png;base64,QUJ",
+    "data:image/png;base64,QQ=A",
+    "data:image/png;base64,Q===",
+])
+def test_data_uri_base64_rejects_invalid(uri):
+    with pytest.raises(ValueError):
+        student_server.data_uri_base64(uri)
+
+
+_TASK = {
+    "email": "a@b", "secret": "s", "task": "t", "round": 1, "nonce": "n",
+    "brief": "b", "evaluation_url": "http://e",
+}
+
+
+def _load_server(name):
+    """A separate instance of the module, standing in for another server process."""
+    spec = importlib.util.spec_from_file_location(name, student_server.__file__)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+@pytest.fixture
+def servers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return _load_server("student_server_a"), _load_server("student_server_b")
+
+
+@pytest.mark.parametrize("body", [
+    b'{"email": "a@b", "secret": 123}',
+    b'{"email": 1, "secret": "s"}',
+    b'{"email": "a@b", "secret": ""}',
+    b'[{"email": "a@b", "secret": "s"}]',
+])
+def test_add_secret_rejects_bad_body(servers, body):
+    client = servers[0].app.test_client()
+    r = client.post("/admin/add_secret", data=body, content_type="application/json")
+    assert r.status_code == 400
+    assert servers[0].secrets_map == {}
+
+
+def test_non_string_secret_in_log_is_skipped(servers, tmp_path):
+    srv = servers[0]
+    (tmp_path / srv.SECRETS_FILE).write_bytes(
+        b'{"email": "a@b", "secret": 123}\n["a@b", "s"]\n{"email": "c@d", "secret": "s"}\n')
+    srv.ensure_server_state()
+    assert srv.secrets_map == {"c@d": "s"}
+    r = srv.app.test_client().post("/api/task", json={**_TASK, "secret": "123"})
+    assert r.status_code == 400
+
+
+@pytest.mark.parametrize("legacy, expected", [
+    (b'{"a@b": 123, "c@d": "s"}', {"c@d": "s"}),
+    (b'[1, 2]', {}),
+    (b'"a@b"', {}),
+])
+def test_legacy_migration_skips_non_string_secrets(servers, tmp_path, legacy, expected):
+    srv = servers[0]
+    (tmp_path / srv.LEGACY_SECRETS_FILE).write_bytes(legacy)
+    srv.ensure_server_state()
+    assert srv.secrets_map == expected
+    assert srv._server_state_ready
+
+
+def test_secrets_log_later_lines_win(servers, tmp_path):
+    srv = servers[0]
+    (tmp_path / srv.SECRETS_FILE).write_bytes(
+        b'{"email": "a@b", "secret": "old"}\n{"email": "c@d", "secret": "s"}\n'
+        b'{"email": "a@b", "secret": "new"}\n')
+    srv.ensure_server_state()
+    assert srv.secrets_map == {"a@b": "new", "c@d": "s"}
+    # superseded lines are compacted away
+    assert (tmp_path / srv.SECRETS_FILE).read_bytes().count(b"\n") == 2
+
+
+def test_secrets_log_torn_line_is_compacted(servers, tmp_path):
+    srv = servers[0]
+    log = tmp_path / srv.SECRETS_FILE
+    log.write_bytes(b'{"email": "a@b", "secret": "s"}\n{"email": "c@d", "sec')
+    srv.ensure_server_state()
+    assert srv.secrets_map == {"a@b": "s"}
+    assert log.read_bytes() == b'{"email":"a@b","secret":"s"}\n'
+
+
+def test_secrets_legacy_file_is_migrated(servers, tmp_path):
+    srv = servers[0]
+    (tmp_path / srv.LEGACY_SECRETS_FILE).write_bytes(b'{"a@b": "s", "c@d": "t"}')
+    srv.ensure_server_state()
+    assert srv.secrets_map == {"a@b": "s", "c@d": "t"}
+    # the log is now the source of truth for a fresh process
+    assert _load_server("student_server_c").load_secrets() == {"a@b": "s", "c@d": "t"}
+
+
+def test_rotated_secret_is_rejected_by_other_process(servers):
+    a, b = servers
+    a.ensure_server_state()
+    b.ensure_server_state()
+    client_a, client_b = a.app.test_client(), b.app.test_client()
+    assert client_a.post("/admin/add_secret", json={"email": "a@b", "secret": "old"}).status_code == 200
+    assert client_a.post("/admin/add_secret", json={"email": "a@b", "secret": "new"}).status_code == 200
+    b.refresh_secrets()
+    assert b.secrets_map == {"a@b": "new"}
+    r = client_b.post("/api/task", json={**_TASK, "secret": "old"})
+    assert r.status_code == 400
+
+
+def test_refresh_replays_log_after_compaction(servers, tmp_path, monkeypatch):
+    a, b = servers
+    log = tmp_path / a.SECRETS_FILE
+    a.ensure_server_state()
+    b.ensure_server_state()
+    a.append_secret("a@b", "1")
+    a.append_secret("a@b", "2")
+    b.refresh_secrets()
+    old_ino = log.stat().st_ino
+    # a third process compacts the log on start, then keeps appending
+    c = _load_server("student_server_c")
+    c.ensure_server_state()
+    c.append_secret("c@d", "3")
+    c.append_secret("a@b", "4")
+    assert log.stat().st_ino != old_ino
+
+    starts = []
+    read = b._read_secrets_log
+    monkeypatch.setattr(b, "_read_secrets_log", lambda m, start=0: starts.append(start) or read(m, start))
+    b.refresh_secrets()
+    assert starts == [0]
+    assert b.secrets_map == {"a@b": "4", "c@d": "3"}
+
+
+def test_submit_task_replaces_broken_pool(monkeypatch, caplog):
+    monkeypatch.setattr(student_server, "_executor", None)
+    try:
+        # os._exit kills the worker outright, like an OOM kill
+        with pytest.raises(BrokenProcessPool):
+            student_server.submit_task(os._exit, 1).result(timeout=30)
+        # done callbacks run just after result() wakes up
+        for _ in range(100):
+            if "Task _exit failed: BrokenProcessPool" in caplog.text:
+                break
+            time.sleep(0.05)
+        assert "Task _exit failed: BrokenProcessPool" in caplog.text
+        broken = student_server._executor
+        assert student_server.submit_task(pow, 2, 3).result(timeout=30) == 8
+        assert student_server._executor is not broken
+    finally:
+        student_server._executor.shutdown()
+
+
+@pytest.mark.parametrize("fields", [
+    {"attachments": [{}]},
+    {"attachments": [{"name": "a.png"}]},
+    {"attachments": [{"name": "a.png", "url": 5}]},
+    {"round": "1"},
+])
+def test_task_rejects_invalid_body(servers, fields):
+    r = servers[0].app.test_client().post("/api/task", json={**_TASK, **fields})
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+def test_task_passes_attachments_as_dicts(servers, monkeypatch):
+    srv = servers[0]
+    srv.app.test_client().post("/admin/add_secret", json={"email": "a@b", "secret": "s"})
+    submitted = []
+    monkeypatch.setattr(srv, "submit_task", lambda fn, task: submitted.append(task))
+    attachments = [{"name": "a.png", "url": "data:image/png;base64,QQ=="}]
+    r = srv.app.test_client().post("/api/task", json={**_TASK, "attachments": attachments})
+    assert r.status_code == 200
+    assert submitted[0]["attachments"] == attachments
+    assert "secret" not in submitted[0]
+
+
+class _Resp:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def notify(monkeypatch):
+    """Run notify_with_backoff against canned responses; returns (result, attempts, sleeps)."""
+    def run(*responses, **kwargs):
+        queue = list(responses)
+        attempts, sleeps = [], []
+        monkeypatch.setattr(student_server.SESSION, "post",
+                            lambda *a, **kw: attempts.append(a) or queue.pop(0))
+        monkeypatch.setattr(student_server.time, "sleep", sleeps.append)
+        ok = student_server.notify_with_backoff("http://e", {}, **kwargs)
+        return ok, len(attempts), sleeps
+    return run
+
+
+@pytest.mark.parametrize("status", [400, 401, 403, 404, 422])
+def test_notify_gives_up_on_permanent_error(notify, status):
+    assert notify(_Resp(status)) == (False, 1, [])
+
+
+@pytest.mark.parametrize("status", [408, 429, 500, 502, 503])
+def test_notify_retries_transient_error(notify, status):
+    assert notify(_Resp(status), _Resp(status), _Resp(200)) == (True, 3, [1, 2])
+
+
+@pytest.mark.parametrize("retry_after, slept", [
+    ("30", 30),
+    ("600", 60),  # capped at max_delay
+    ("Wed, 21 Oct 2026 07:28:00 GMT", 1),  # HTTP-date: our own backoff
+])
+def test_notify_honors_retry_after(notify, retry_after, slept):
+    assert notify(_Resp(429, {"Retry-After": retry_after}), _Resp(200)) == (True, 2, [slept])
+
+
+def test_notify_stops_after_max_attempts(notify):
+    assert notify(*[_Resp(500)] * 4, max_attempts=4) == (False, 4, [1, 2, 4])
+
+
+
+class _GitHub:
+    """Stands in for SESSION against the GitHub API; records (method, url, kwargs) per call."""
+
+    def __init__(self, fail=None, default_branch="main"):
+        self.fail = fail
+        self.default_branch = default_branch
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        if self.fail and self.fail in url:
+            return _GHResp(500)
+        if url.endswith("/user/repos"):
+            return _GHResp(201, {"html_url": "https://github.com/u/r", "default_branch": self.default_branch})
+        if url.endswith("/blobs"):
+            return _GHResp(201, {"sha": "blob-" + orjson.loads(kwargs["data"])["content"]})
+        if url.endswith("/trees"):
+            return _GHResp(201, {"sha": "tree-sha"})
+        if url.endswith("/commits"):
+            return _GHResp(201, {"sha": "commit-sha"})
+        return _GHResp(201, {})
+
+
+class _GHResp(_Resp):
+    def __init__(self, status_code, body=None):
+        super().__init__(status_code)
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+
+@pytest.fixture
+def github(monkeypatch):
+    def install(fail=None, default_branch="main"):
+        gh = _GitHub(fail, default_branch)
+        for method in ("post", "put", "patch"):
+            monkeypatch.setattr(student_server.SESSION, method,
+                                functools.partial(gh.request, method.upper()))
+        return gh
+    return install
+
+
+def test_github_commit_files_call_sequence(github):
+    gh = github()
+    student_server.github_seed_branch("u", "r")
+    sha = student_server.github_commit_files(
+        "u", "r", {"index.html": "aW5kZXg=", "a.png": "UE5H"}, "msg", "name", "a@b")
+    assert sha == "commit-sha"
+
+    api = "https://api.github.com/repos/u/r"
+    assert [(m, url) for m, url, _ in gh.calls] == [
+        ("PUT", f"{api}/contents/.nojekyll"),
+        ("POST", f"{api}/git/blobs"),
+        ("POST", f"{api}/git/blobs"),
+        ("POST", f"{api}/git/trees"),
+        ("POST", f"{api}/git/commits"),
+        ("PATCH", f"{api}/git/refs/heads/main"),
+    ]
+    blobs = [kw for _, url, kw in gh.calls if url.endswith("/blobs")]
+    assert sorted(orjson.loads(kw["data"])["content"] for kw in blobs) == ["UE5H", "aW5kZXg="]
+    assert all(kw["headers"]["Content-Type"] == "application/json" for kw in blobs)
+    assert all(orjson.loads(kw["data"])["encoding"] == "base64" for kw in blobs)
+
+    (_, _, tree), (_, _, commit), (_, _, ref) = gh.calls[3:]
+    assert tree["json"]["tree"] == [
+        {"path": "a.png", "mode": "100644", "type": "blob", "sha": "blob-UE5H"},
+        {"path": "index.html", "mode": "100644", "type": "blob", "sha": "blob-aW5kZXg="},
+    ]
+    assert commit["json"] == {
+        "message": "msg", "tree": "tree-sha", "parents": [],
+        "author": {"name": "name", "email": "a@b"},
+    }
+    assert ref["json"] == {"sha": "commit-sha", "force": True}
+
+
+@pytest.mark.parametrize("fail", ["/user/repos", "/contents/.nojekyll", "/git/blobs", "/git/trees",
+                                  "/git/commits", "/git/refs/heads/"])
+def test_process_task_stops_on_github_error(github, monkeypatch, fail):
+    gh = github(fail)
+    later = []
+    monkeypatch.setattr(student_server, "wait_for_pages", lambda *a, **kw: later.append("pages"))
+    monkeypatch.setattr(student_server, "notify_with_backoff", lambda *a, **kw: later.append("notify"))
+    task = {k: v for k, v in _TASK.items() if k != "secret"}
+    student_server.process_task(task)
+    assert any(fail in url for _, url, _ in gh.calls)
+    assert later == []
+
+
+def test_process_task_uses_default_branch(github, monkeypatch):
+    gh = github(default_branch="trunk")
+    later = []
+    monkeypatch.setattr(student_server, "wait_for_pages", lambda *a, **kw: later.append("pages"))
+    monkeypatch.setattr(student_server, "notify_with_backoff", lambda *a, **kw: later.append("notify"))
+    student_server.process_task({k: v for k, v in _TASK.items() if k != "secret"})
+    assert later == ["pages", "notify"]
+    calls = {url.rsplit("/", 1)[-1]: kw for _, url, kw in gh.calls}
+    assert calls[".nojekyll"]["json"]["branch"] == "trunk"
+    assert calls["pages"]["json"]["source"]["branch"] == "trunk"
+    assert any(url.endswith("/git/refs/heads/trunk") for _, url, _ in gh.calls)
+
+
+def test_process_task_joins_pages_when_commit_fails(github, monkeypatch):
+    github(fail="/git/trees")
+    pages = []
+
+    def slow_enable_pages(owner, repo, branch):
+        time.sleep(0.2)
+        pages.append(branch)
+
+    monkeypatch.setattr(student_server, "github_enable_pages", slow_enable_pages)
+    student_server.process_task({k: v for k, v in _TASK.items() if k != "secret"})
+    assert pages == ["main"]
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    """Run wait_for_pages on a fake clock; returns (result, HEAD count, sleeps)."""
+    def run(*statuses, timeout):
+        clock = [0.0]
+        heads, sleeps = [], []
+
+        def head(url, **kwargs):
+            heads.append(kwargs)
+            status = statuses[len(heads) - 1] if len(heads) <= len(statuses) else 404
+            return _Resp(status)
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        monkeypatch.setattr(student_server.SESSION, "head", head)
+        monkeypatch.setattr(student_server.time, "monotonic", lambda: clock[0])
+        monkeypatch.setattr(student_server.time, "sleep", sleep)
+        ok = student_server.wait_for_pages("https://u.github.io/r/", timeout=timeout)
+        assert all(kw["allow_redirects"] for kw in heads)
+        return ok, len(heads), sleeps
+    return run
+
+
+def test_wait_for_pages_returns_on_200(pages):
+    assert pages(404, 404, 200, timeout=180) == (True, 3, [1, 1.5])
+
+
+def test_wait_for_pages_backs_off_to_max_delay(pages):
+    ok, heads, sleeps = pages(timeout=60)
+    assert not ok
+    assert sleeps[:6] == pytest.approx([1, 1.5, 2.25, 3.375, 5.0625, 7.59375])
+    assert set(sleeps[6:-1]) == {10}
+    # the last sleep is cut short so the probe stops at the timeout
+    assert sum(sleeps) == pytest.approx(60)
+    assert heads == len(sleeps)